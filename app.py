@@ -6,7 +6,7 @@ Features:
 - Modern splash screen + gradient
 - Bubble-style chat UI (user: right purple | assistant: left red/white)
 - File upload inside input area (pdf/docx/txt/md)
-- File parsing with PyPDF2, python-docx, markdown2
+- File parsing with pypdfium2 (PyPDF2 fallback), python-docx, markdown2
 - Auto-generated: summary, key concepts, quiz Qs, suggested search queries
 - Reasoning modes: Explain, Quiz, Review, Deep Thinking
 - Edit last question per-bubble, copy assistant reply to clipboard
@@ -20,27 +20,21 @@ import os
 import io
 import time
 import html
-import tempfile
-from typing import Tuple, List, Dict
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Dict, Optional, Iterator
 
 import streamlit as st
 import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-# File parsing libs
-from PyPDF2 import PdfReader
-import docx
-import markdown2
+import numpy as np
 
-# Optional LLM libs (may or may not exist in environment)
-try:
-    from google import genai
-except Exception:
-    genai = None
-
-try:
-    import openai
-except Exception:
-    openai = None
+# Heavy and optional libs (PyPDF2, pypdfium2, python-docx, markdown2, google.genai,
+# openai, sentence-transformers) are imported inside the functions that use them,
+# so cold starts and reruns that don't touch them skip the import cost.
 
 # ----------------------
 # Configuration & Utils
@@ -51,6 +45,31 @@ PAGE_ICON = "✨"
 MODEL_NAME_DEFAULT = os.getenv("LLM_MODEL", "gemini-2.0-flash")
 MAX_FILE_TEXT = 120000  # characters allowed from file
 MAX_PROMPT_CHUNK = 6000  # chunk size to send to LLM for file summarization
+SUMMARY_CHUNK_OVERLAP = 200  # characters shared between neighbouring summary chunks
+SUMMARY_CONCURRENCY = 5  # max parallel LLM calls, to stay under provider rate limits
+RESPONSE_CACHE_TTL = 3600  # seconds a cached LLM response stays valid
+RESPONSE_CACHE_MAX_ENTRIES = 512
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.92  # cosine similarity needed to reuse an answer
+SEMANTIC_CACHE_MAX_ENTRIES = 1024
+SEMANTIC_CACHE_MAX_PROMPT = 1000  # longer prompts (e.g. documents) only use the exact cache
+
+SYSTEM_PREAMBLE = (
+    "You are Study Wise Ai Tutor — a helpful, patient, step-by-step AI tutor. "
+    "When asked, provide clear explanations, list key steps, produce short quizzes, and suggest external resources "
+    "if enabled. Keep answers concise but thorough; when asked for step-by-step, number steps. "
+)
+
+# Per-turn settings go last so the static preamble stays a cacheable prefix
+USER_MESSAGE_TMPL = "{prompt}\n\nMode: {reasoning}\nExternalLinksAllowed: {external_refs}"
+SUMMARY_PROMPT_TMPL = "Summarize and analyze this document:\n{text}"
+CHUNK_SUMMARY_PROMPT_TMPL = "Summarize the key points of this part of a document:\n{text}"
+COMBINE_SUMMARIES_PROMPT = (
+    "These are summaries of consecutive parts of one document. "
+    "Combine them into a single summary and analysis of the whole document:\n\n"
+)
+UPLOAD_MSG_TMPL = "Uploaded file: {name}"
+DOC_CONTEXT_TMPL = "Uploaded file: {name}\n\n{text}"
 
 st.set_page_config(page_title=PAGE_TITLE, page_icon=PAGE_ICON, layout="wide")
 
@@ -58,47 +77,270 @@ st.set_page_config(page_title=PAGE_TITLE, page_icon=PAGE_ICON, layout="wide")
 # LLM helper functions
 # ----------------------
 
+def get_api_key(name: str):
+    """Read an API key from the environment, falling back to Streamlit secrets."""
+    key = os.getenv(name)
+    if key:
+        return key
+    try:
+        return st.secrets.get(name)
+    except Exception:
+        # No secrets.toml configured
+        return None
+
+@st.cache_resource(show_spinner=False)
 def get_gemini_client():
-    api_key = os.getenv("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY") if "GEMINI_API_KEY" in st.secrets else None
-    if api_key and genai is not None:
-        return genai.Client(api_key=api_key)
-    return None
+    # Cached so one Client (and its HTTP connection pool) is shared across reruns
+    api_key = get_api_key("GEMINI_API_KEY")
+    if not api_key:
+        return None
+    try:
+        from google import genai
+    except Exception:
+        return None
+    return genai.Client(api_key=api_key)
 
+@st.cache_resource(show_spinner=False)
 def get_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY") or st.secrets.get("OPENAI_API_KEY") if "OPENAI_API_KEY" in st.secrets else None
-    if api_key and openai is not None:
-        openai.api_key = api_key
-        return openai
+    api_key = get_api_key("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    try:
+        import openai
+    except Exception:
+        return None
+    openai.api_key = api_key
+    return openai
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache() -> dict:
+    # Shared across sessions: prompt hash -> (timestamp, response text), LRU ordered
+    return {"entries": OrderedDict(), "lock": threading.Lock()}
+
+def response_cache_key(prompt: str, mode_meta: dict, max_output_tokens: int, history: list = None) -> str:
+    normalized = " ".join(prompt.split())
+    parts = [
+        MODEL_NAME_DEFAULT,
+        str(mode_meta.get("reasoning", "explain")),
+        str(mode_meta.get("external_refs", True)),
+        str(max_output_tokens),
+        normalized,
+    ]
+    # Follow-up questions only match within the same conversation so far
+    for content in history or []:
+        parts.append(content.role or "")
+        parts.extend(part.text or "" for part in content.parts or [])
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+def response_cache_get(key: str) -> Optional[str]:
+    cache = get_response_cache()
+    stats = st.session_state.setdefault("cache_stats", {"hits": 0, "misses": 0, "semantic_hits": 0})
+    with cache["lock"]:
+        entries = cache["entries"]
+        entry = entries.get(key)
+        if entry is not None and time.time() - entry[0] < RESPONSE_CACHE_TTL:
+            entries.move_to_end(key)
+            stats["hits"] += 1
+            return entry[1]
+        entries.pop(key, None)
+    stats["misses"] += 1
+    return None
+
+def response_cache_put(key: str, response: str):
+    cache = get_response_cache()
+    with cache["lock"]:
+        entries = cache["entries"]
+        entries[key] = (time.time(), response)
+        entries.move_to_end(key)
+        while len(entries) > RESPONSE_CACHE_MAX_ENTRIES:
+            entries.popitem(last=False)
+
+@st.cache_resource(show_spinner=False)
+def get_embedder():
+    try:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(EMBED_MODEL_NAME)
+    except Exception:
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache() -> dict:
+    # Row i of "embeddings" is the normalized embedding for items[i] = (context key, response)
+    return {"embeddings": None, "items": [], "last_used": [], "tick": 0, "lock": threading.Lock()}
+
+def semantic_context_key(mode_meta: dict, max_output_tokens: int) -> str:
+    # Everything except the prompt text that must match for a cached answer to be reusable
+    return f"{MODEL_NAME_DEFAULT}|{mode_meta.get('reasoning', 'explain')}|{mode_meta.get('external_refs', True)}|{max_output_tokens}"
+
+def embed_prompt(prompt: str):
+    if len(prompt) > SEMANTIC_CACHE_MAX_PROMPT:
+        return None
+    model = get_embedder()
+    if model is None:
+        return None
+    try:
+        return model.encode([prompt], normalize_embeddings=True)[0].astype(np.float32)
+    except Exception:
+        return None
+
+def semantic_cache_get(vec, context: str) -> Optional[str]:
+    cache = get_semantic_cache()
+    with cache["lock"]:
+        if cache["embeddings"] is None:
+            return None
+        sims = cache["embeddings"] @ vec
+        for i in np.argsort(sims)[::-1]:
+            if sims[i] <= SEMANTIC_CACHE_THRESHOLD:
+                break
+            if cache["items"][i][0] == context:
+                cache["tick"] += 1
+                cache["last_used"][i] = cache["tick"]
+                return cache["items"][i][1]
     return None
 
-def generate_response(prompt: str, mode_meta: dict = None, max_output_tokens: int = 500) -> str:
-    system_preamble = (
-        "You are Study Wise Ai Tutor — a helpful, patient, step-by-step AI tutor. "
-        "When asked, provide clear explanations, list key steps, produce short quizzes, and suggest external resources "
-        "if enabled. Keep answers concise but thorough; when asked for step-by-step, number steps. "
+def semantic_cache_put(vec, context: str, response: str):
+    cache = get_semantic_cache()
+    with cache["lock"]:
+        cache["tick"] += 1
+        if cache["embeddings"] is None:
+            cache["embeddings"] = vec[np.newaxis, :]
+            cache["items"].append((context, response))
+            cache["last_used"].append(cache["tick"])
+        elif len(cache["items"]) < SEMANTIC_CACHE_MAX_ENTRIES:
+            cache["embeddings"] = np.vstack([cache["embeddings"], vec])
+            cache["items"].append((context, response))
+            cache["last_used"].append(cache["tick"])
+        else:
+            # Overwrite the least recently used row in place
+            i = int(np.argmin(cache["last_used"]))
+            cache["embeddings"][i] = vec
+            cache["items"][i] = (context, response)
+            cache["last_used"][i] = cache["tick"]
+
+def new_chat_session(history: list = None):
+    gemini = get_gemini_client()
+    if gemini is None:
+        return None
+    return gemini.chats.create(
+        model=MODEL_NAME_DEFAULT,
+        config={"system_instruction": SYSTEM_PREAMBLE},
+        history=history or [],
     )
 
+def record_chat_turn(user_text: str, reply: str):
+    """Add a turn that the Gemini chat didn't produce itself to the session's chat history."""
+    chat = st.session_state.get("chat_session")
+    if chat is None:
+        return
+    st.session_state.chat_session = new_chat_session(chat.get_history() + [
+        {"role": "user", "parts": [{"text": user_text}]},
+        {"role": "model", "parts": [{"text": reply}]},
+    ])
+
+def build_user_message(prompt: str, mode_meta: dict) -> str:
+    return USER_MESSAGE_TMPL.format(
+        prompt=prompt,
+        reasoning=mode_meta.get("reasoning", "explain"),
+        external_refs=mode_meta.get("external_refs", True),
+    )
+
+def stream_response(prompt: str, mode_meta: dict = None, max_output_tokens: int = 500,
+                    use_chat: bool = False) -> Iterator[str]:
+    """Yield the answer in chunks as it arrives; cached answers are yielded in one piece.
+
+    With use_chat, the prompt is sent as the next turn of the session's Gemini chat.
+    """
     if mode_meta is None:
         mode_meta = {}
 
-    external_flag = mode_meta.get("external_refs", True)
-    reasoning = mode_meta.get("reasoning", "explain")
-    assembled_prompt = f"{system_preamble}\nMode: {reasoning}\nExternalLinksAllowed: {external_flag}\n\n{prompt}"
+    chat = st.session_state.get("chat_session") if use_chat else None
+    history = chat.get_history() if chat is not None else []
+
+    key = response_cache_key(prompt, mode_meta, max_output_tokens, history)
+    cached = response_cache_get(key)
+
+    # Paraphrased re-asks: look for a near-duplicate question answered before.
+    # Only for typed questions that start a conversation: follow-ups depend on
+    # the history, and two similar short documents must not share a summary.
+    context = semantic_context_key(mode_meta, max_output_tokens)
+    vec = embed_prompt(prompt) if use_chat and cached is None and not history else None
+    if vec is not None:
+        cached = semantic_cache_get(vec, context)
+        if cached is not None:
+            st.session_state.cache_stats["semantic_hits"] += 1
+            response_cache_put(key, cached)
+
+    if cached is not None:
+        if chat is not None:
+            # Keep the chat's history complete even though the model wasn't called
+            record_chat_turn(build_user_message(prompt, mode_meta), cached)
+        yield cached
+        return
+
+    parts = []
+    status = {}
+    for chunk in stream_llm(prompt, mode_meta, max_output_tokens, chat, status):
+        parts.append(chunk)
+        yield chunk
+    resp = "".join(parts)
+    if resp and chat is not None and status.get("provider") != "gemini":
+        # Answered by the OpenAI fallback, so the Gemini chat hasn't seen this turn
+        record_chat_turn(build_user_message(prompt, mode_meta), resp)
+    if resp:
+        if not status["complete"]:
+            return  # cut off by an error; show it but don't cache it
+        response_cache_put(key, resp)
+        if vec is not None:
+            semantic_cache_put(vec, context, resp)
+        return
+
+    yield ("[Local fallback response]\n\n"
+           + (prompt[:800] + ("..." if len(prompt) > 800 else "")))
+
+def generate_response(prompt: str, mode_meta: dict = None, max_output_tokens: int = 500,
+                      use_chat: bool = False) -> str:
+    return "".join(stream_response(prompt, mode_meta, max_output_tokens, use_chat))
+
+def stream_llm(prompt: str, mode_meta: dict, max_output_tokens: int, chat=None,
+               status: dict = None) -> Iterator[str]:
+    """Stream the answer from Gemini, then OpenAI. Yields nothing if neither answered.
+
+    status["complete"] is set to True only when a provider finished its answer,
+    so callers can tell a full reply from one cut off by an error.
+    """
+    if status is None:
+        status = {}
+    status["complete"] = False
+    status["provider"] = None
+    user_message = build_user_message(prompt, mode_meta)
+    config = {"system_instruction": SYSTEM_PREAMBLE, "max_output_tokens": max_output_tokens}
+
+    # Once any text has been shown we can't switch providers mid-answer
+    started = False
 
     # Try Gemini
     gemini = get_gemini_client()
     if gemini:
         try:
-            resp = gemini.models.generate_content(
-                model=MODEL_NAME_DEFAULT,
-                contents=assembled_prompt,
-                config={"max_output_tokens": max_output_tokens}
-            )
-            if hasattr(resp, "text") and resp.text:
-                return resp.text
-            return str(resp)
+            if chat is not None:
+                # A per-call config replaces the chat's own, so it repeats the system instruction
+                stream = chat.send_message_stream(user_message, config=config)
+            else:
+                stream = gemini.models.generate_content_stream(
+                    model=MODEL_NAME_DEFAULT,
+                    contents=user_message,
+                    config=config
+                )
+            for chunk in stream:
+                if chunk.text:
+                    started = True
+                    status["provider"] = "gemini"
+                    yield chunk.text
+            status["complete"] = started
         except Exception as e:
             st.error(f"Gemini error: {e}")
+        if started:
+            return
 
     # Try OpenAI
     openai_client = get_openai_client()
@@ -106,57 +348,153 @@ def generate_response(prompt: str, mode_meta: dict = None, max_output_tokens: in
         try:
             if hasattr(openai_client, "ChatCompletion"):
                 messages = [
-                    {"role": "system", "content": system_preamble},
-                    {"role": "user", "content": prompt}
+                    {"role": "system", "content": SYSTEM_PREAMBLE},
+                    {"role": "user", "content": user_message}
                 ]
-                resp = openai_client.ChatCompletion.create(
+                stream = openai_client.ChatCompletion.create(
                     model=os.getenv("OPENAI_MODEL") or "gpt-3.5-turbo",
                     messages=messages,
                     max_tokens=max_output_tokens,
                     temperature=0.2,
+                    stream=True,
                 )
-                return resp.choices[0].message.content.strip()
+                for chunk in stream:
+                    text = chunk.choices[0].delta.get("content")
+                    if text:
+                        started = True
+                        status["provider"] = "openai"
+                        yield text
             else:
-                resp = openai_client.Completion.create(
+                stream = openai_client.Completion.create(
                     engine="text-davinci-003",
-                    prompt=assembled_prompt,
+                    prompt=f"{SYSTEM_PREAMBLE}\n\n{user_message}",
                     max_tokens=max_output_tokens,
                     temperature=0.2,
+                    stream=True,
                 )
-                return resp.choices[0].text.strip()
+                for chunk in stream:
+                    text = chunk.choices[0].text
+                    if text:
+                        started = True
+                        status["provider"] = "openai"
+                        yield text
+            status["complete"] = started
         except Exception as e:
             st.error(f"OpenAI error: {e}")
 
-    return ("[Local fallback response]\n\n"
-            + (assembled_prompt[:800] + ("..." if len(assembled_prompt) > 800 else "")))
+def script_thread_pool(max_workers: int) -> ThreadPoolExecutor:
+    # Workers inherit the script context so they can use st.session_state / st.error
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx, initargs=(None, ctx))
+
+def split_text(text: str, size: int = MAX_PROMPT_CHUNK, overlap: int = SUMMARY_CHUNK_OVERLAP) -> List[str]:
+    step = size - overlap
+    chunks = []
+    start = 0
+    # A short leftover is folded into the last chunk (at most size + step // 2 long)
+    # instead of becoming a chunk that is mostly overlap
+    while len(text) - start > size + step // 2:
+        chunks.append(text[start:start + size])
+        start += step
+    chunks.append(text[start:])
+    return chunks
+
+def summarize_document(text: str) -> Iterator[str]:
+    """Map-reduce summary: summarize chunks in parallel, then stream the combined summary."""
+    chunks = split_text(text)
+    if len(chunks) == 1:
+        yield from stream_response(SUMMARY_PROMPT_TMPL.format(text=chunks[0]))
+        return
+
+    def summarize_chunk(chunk: str) -> str:
+        return generate_response(CHUNK_SUMMARY_PROMPT_TMPL.format(text=chunk), max_output_tokens=300)
+
+    with script_thread_pool(min(SUMMARY_CONCURRENCY, len(chunks))) as ex:
+        partials = list(ex.map(summarize_chunk, chunks))
+    yield from stream_response(COMBINE_SUMMARIES_PROMPT + "\n\n---\n\n".join(partials))
 
 # ----------------------
 # File parsing utilities
 # ----------------------
 
-def read_pdf_bytes(bytes_data: bytes) -> str:
+def extract_page_text(page) -> str:
     try:
-        reader = PdfReader(io.BytesIO(bytes_data))
-        pages = []
-        for p in reader.pages:
+        return page.extract_text() or ""
+    except Exception:
+        return ""
+
+def append_block(buf: io.StringIO, text: str) -> int:
+    """Append text to buf, separated from earlier blocks by a blank line; returns the new length."""
+    if buf.tell():
+        buf.write("\n\n")
+    buf.write(text)
+    return buf.tell()
+
+@st.cache_resource(show_spinner=False)
+def get_pdfium_lock() -> threading.Lock:
+    # Process-wide: PDFium calls must never overlap, even on different documents
+    return threading.Lock()
+
+def read_pdf_pdfium(bytes_data: bytes) -> str:
+    import pypdfium2 as pdfium
+
+    # Sessions run in their own threads, so every pdfium call goes under one lock
+    with get_pdfium_lock():
+        return extract_pdfium_text(pdfium, bytes_data)
+
+def extract_pdfium_text(pdfium, bytes_data: bytes) -> str:
+    pdf = pdfium.PdfDocument(bytes_data)
+    try:
+        buf = io.StringIO()
+        for i in range(len(pdf)):
+            page = pdf[i]
             try:
-                text = p.extract_text()
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
             except Exception:
                 text = ""
-            if text:
-                pages.append(text)
-        return "\n\n".join(pages)
+            finally:
+                page.close()
+            if text and append_block(buf, text.replace("\r\n", "\n")) >= MAX_FILE_TEXT:
+                break  # the rest would be truncated anyway
+        return buf.getvalue()
+    finally:
+        pdf.close()
+
+def read_pdf_bytes(bytes_data: bytes) -> str:
+    try:
+        return read_pdf_pdfium(bytes_data)
+    except Exception:
+        pass  # pypdfium2 missing or failed; fall back to PyPDF2
+    try:
+        from PyPDF2 import PdfReader
+
+        reader = PdfReader(io.BytesIO(bytes_data))
+        buf = io.StringIO()
+        # Serial on purpose: pages share the reader's stream, so threads would
+        # read from each other's positions
+        for page in reader.pages:
+            text = extract_page_text(page)
+            if text and append_block(buf, text) >= MAX_FILE_TEXT:
+                break  # the rest would be truncated anyway
+        return buf.getvalue()
     except Exception as e:
         return f"[Error reading PDF: {e}]"
 
 def read_docx_bytes(bytes_data: bytes) -> str:
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-            tmp.write(bytes_data)
-            tmp.flush()
-            doc = docx.Document(tmp.name)
-            paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-            return "\n\n".join(paragraphs)
+        import docx
+
+        doc = docx.Document(io.BytesIO(bytes_data))
+        buf = io.StringIO()
+        for p in doc.paragraphs:
+            text = p.text
+            if text.strip() and append_block(buf, text) >= MAX_FILE_TEXT:
+                break
+        return buf.getvalue()
     except Exception as e:
         return f"[Error reading DOCX: {e}]"
 
@@ -166,21 +504,38 @@ def read_text_bytes(bytes_data: bytes, encoding="utf-8") -> str:
     except Exception:
         return bytes_data.decode("latin-1", errors="replace")
 
-def parse_uploaded_file(uploaded_file) -> Tuple[str, str]:
-    name = uploaded_file.name
-    raw = uploaded_file.read()
-    lower = name.lower()
-    if lower.endswith(".pdf"):
+@st.cache_resource(show_spinner=False)
+def get_markdown_converter() -> dict:
+    import markdown2
+
+    # Build the parser once; Markdown.convert() mutates the instance, so calls are serialized
+    return {"md": markdown2.Markdown(extras=["fenced-code-blocks", "tables"]), "lock": threading.Lock()}
+
+def markdown_to_html(text: str) -> str:
+    converter = get_markdown_converter()
+    with converter["lock"]:
+        return converter["md"].convert(text)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def parse_file_bytes(raw: bytes, ext: str) -> str:
+    # Cached on the file contents, so reruns and re-uploads of the same file skip parsing
+    if ext == ".pdf":
         text = read_pdf_bytes(raw)
-    elif lower.endswith(".docx"):
+    elif ext == ".docx":
         text = read_docx_bytes(raw)
     else:
         text = read_text_bytes(raw)
-        if lower.endswith(".md"):
-            text = markdown2.markdown(text)
+        if ext == ".md":
+            text = markdown_to_html(text)
     if len(text) > MAX_FILE_TEXT:
         text = text[:MAX_FILE_TEXT] + "\n\n[Truncated]"
-    return name, text
+    return text
+
+def parse_uploaded_file(uploaded_file) -> Tuple[str, str]:
+    name = uploaded_file.name
+    raw = uploaded_file.getvalue()  # unlike read(), doesn't depend on the cursor position
+    ext = os.path.splitext(name.lower())[1]
+    return name, parse_file_bytes(raw, ext)
 
 # ----------------------
 # Session state & helpers
@@ -193,18 +548,48 @@ def init_session_state():
         st.session_state.files = []
     if "external_refs_enabled" not in st.session_state:
         st.session_state.external_refs_enabled = True
+    if "uploader_key" not in st.session_state:
+        st.session_state.uploader_key = 0
+    if "chat_session" not in st.session_state:
+        st.session_state.chat_session = new_chat_session()
 
-def push_chat(role: str, content: str, meta: dict = None):
+def make_chat_msg(role: str, content: str, meta: dict = None) -> dict:
     if meta is None:
         meta = {}
-    st.session_state.chat.append({"role": role, "content": content, "meta": meta, "ts": time.time()})
+    return {"role": role, "content": content, "meta": meta, "ts": time.monotonic_ns()}
 
 # ----------------------
 # UI Rendering
 # ----------------------
 
+# Bubble styling for st.chat_message: user on the right in purple, assistant on the left
+CHAT_CSS = """
+<style>
+[data-testid="stChatMessage"]:has([data-testid="stChatMessageAvatarUser"]) {
+    flex-direction: row-reverse;
+    text-align: right;
+    background: #6a49ff;
+    color: white;
+}
+[data-testid="stChatMessage"]:has([data-testid="stChatMessageAvatarAssistant"]) {
+    background: white;
+    border-left: 4px solid #e53935;
+}
+</style>
+"""
+
+def inject_css():
+    # Must run every rerun: Streamlit drops elements that a rerun doesn't emit
+    st.markdown(CHAT_CSS, unsafe_allow_html=True)
+
+def render_chat():
+    for msg in st.session_state.chat:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
 def main():
     init_session_state()
+    inject_css()
 
     st.title("✨ Study Wise Ai Tutor ✨")
     st.markdown("Your personal AI-powered study companion. Study Wise Ai Tutor helps you learn faster with smart explanations, file analysis, external references, and interactive reasoning.")
@@ -215,32 +600,65 @@ def main():
         if st.button("Clear chat"):
             st.session_state.chat = []
             st.session_state.files = []
+            st.session_state.chat_session = new_chat_session()
+            # A new key gives a fresh, empty uploader; otherwise its file would look new again
+            st.session_state.uploader_key += 1
             st.rerun()
 
-    # Display chat
-    for msg in st.session_state.chat:
-        if msg["role"] == "user":
-            st.chat_message("user").write(msg["content"])
-        else:
-            st.chat_message("assistant").write(msg["content"])
+    render_chat()
 
     # Input area
     user_input = st.chat_input("Ask a question...")
-    uploaded = st.file_uploader("Upload file", type=["pdf", "docx", "txt", "md"])
-
-    if uploaded:
-        filename, text = parse_uploaded_file(uploaded)
-        push_chat("user", f"Uploaded file: {filename}")
-        analysis_prompt = f"Summarize and analyze this document:\n{text[:MAX_PROMPT_CHUNK]}"
-        resp = generate_response(analysis_prompt)
-        push_chat("assistant", resp)
-        st.rerun()
-
-    if user_input:
-        push_chat("user", user_input)
-        resp = generate_response(user_input)
-        push_chat("assistant", resp)
-        st.rerun()
+    uploaded = st.file_uploader("Upload file", type=["pdf", "docx", "txt", "md"], key=f"uploader_{st.session_state.uploader_key}")
+
+    # The uploader keeps its file across reruns; only analyze each file once
+    file_hash = hashlib.sha256(uploaded.getvalue()).hexdigest() if uploaded else None
+    new_file = uploaded is not None and file_hash not in (f["sha256"] for f in st.session_state.files)
+    if not (new_file or user_input):
+        return
+
+    # File and question sent together: answer the question in the background
+    # while the summary streams, so the wait is max(t1, t2) rather than t1 + t2
+    pool = script_thread_pool(1) if new_file and user_input else None
+    answer_future = pool.submit(generate_response, user_input, None, 500, True) if pool else None
+    summary = None
+    resp = None
+    try:
+        if new_file:
+            filename, text = parse_uploaded_file(uploaded)
+            upload_msg = UPLOAD_MSG_TMPL.format(name=filename)
+            st.chat_message("user").markdown(upload_msg)
+            with st.chat_message("assistant"):
+                summary = st.write_stream(summarize_document(text))
+
+        if user_input:
+            st.chat_message("user").markdown(user_input)
+            with st.chat_message("assistant"):
+                if answer_future is not None:
+                    resp = answer_future.result()
+                    st.markdown(resp)
+                else:
+                    resp = st.write_stream(stream_response(user_input, use_chat=True))
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+        # One session-state update, also when a rerun interrupts us part-way.
+        # A file only counts as seen once its summary is done; the question is
+        # always kept, like before, since chat_input won't resend it.
+        new_msgs = []
+        if summary is not None and (answer_future is None or answer_future.done()):
+            st.session_state.files.append({"name": filename, "sha256": file_hash})
+            new_msgs.append(make_chat_msg("user", upload_msg))
+            new_msgs.append(make_chat_msg("assistant", summary))
+            # Give follow-up questions the document and its summary as context. Recorded
+            # after the background answer so that turn isn't lost when the chat is rebuilt.
+            record_chat_turn(DOC_CONTEXT_TMPL.format(name=filename, text=text), summary)
+        if user_input:
+            new_msgs.append(make_chat_msg("user", user_input))
+            if resp is not None:
+                new_msgs.append(make_chat_msg("assistant", resp))
+        st.session_state.chat.extend(new_msgs)
+    st.rerun()
 
 if __name__ == "__main__":
     main()